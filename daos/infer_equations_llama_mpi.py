@@ -11,8 +11,9 @@ EACH MPI RANK:
           port = BASE_PORT + local_rank
       where BASE_PORT defaults to 18080 (must match the PBS script).
     - Iterates through all Parquet files
-    - Processes ONLY rows i where (i % world_size == world_rank)
-    - Writes outputs + checkpoints in per-rank files (no conflict)
+    - Processes ONLY unique expressions whose hash maps to this rank
+    - Writes outputs in per-rank files (no conflict); the written rows double
+      as the resume state
 
 This yields good load balancing over massive Parquet files while keeping
 the 120B model loaded and "warm" inside llama-server.
@@ -22,18 +23,36 @@ the 120B model loaded and "warm" inside llama-server.
 # MPI + imports
 # =============================================================================
 from mpi4py import MPI
+import hashlib
 import os
+import queue
+import threading
 import time
 import socket
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
 from jsonschema import Draft7Validator
 
+try:  # codegen validator, ~5-10x faster than jsonschema's interpreter
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:  # C-implemented JSON; fall back to stdlib when unavailable
+    import orjson
+except ImportError:
+    orjson = None
+
 from math_prompt import PROMPT_TEMPLATE_v2 as PROMPT_TEMPLATE
 from math_prompt import PURE_MATH_JSON_SCHEMA
 
@@ -67,22 +86,120 @@ MAX_GENERATION_TOKENS = int(os.environ.get("LLAMA_SERVER_MAX_TOKENS", "500"))
 # HTTP timeout (seconds)
 SERVER_TIMEOUT = float(os.environ.get("LLAMA_SERVER_TIMEOUT", "600"))
 
+# Which llama-server API to hit:
+#   "chat" (default): /v1/chat/completions; the server wraps the prompt in
+#       the model's chat template, which is the input distribution the
+#       chat-tuned model was trained on.
+#   "completion": POST the rendered prompt to /completion with cache_prompt,
+#       so the constant PROMPT_TEMPLATE prefix stays in the slot KV cache and
+#       per-request prefill only covers the LaTeX suffix. The prompt is sent
+#       raw — NO chat-template wrapping — so the model sees a different token
+#       stream than the chat path. Opt-in until A/B-validated against "chat".
+SERVER_ENDPOINT = os.environ.get("LLAMA_SERVER_ENDPOINT", "chat")
+
+# One shared session so the TCP connection to the loopback server is reused
+# across requests (and across worker threads when --concurrency > 1). The
+# pool is sized generously so concurrent workers never block on a free socket.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=64, pool_maxsize=64))
+
 # =============================================================================
 # Helper functions
 # =============================================================================
 
+# Compiled once; these run on every row of every Parquet file.
+_LABEL_RE = re.compile(r"\\label\{[^}]*\}")
+_JSON_TAIL_RE = re.compile(r"\{.*\}\s*$", re.DOTALL)
+
+# The schema never changes, so compile the validator once instead of
+# re-walking the schema on every row. fastjsonschema codegens a specialized
+# function; jsonschema's interpreter is the fallback.
+if fastjsonschema is not None:
+    _validate = fastjsonschema.compile(PURE_MATH_JSON_SCHEMA)
+else:
+    Draft7Validator.check_schema(PURE_MATH_JSON_SCHEMA)
+    _validate = Draft7Validator(PURE_MATH_JSON_SCHEMA).validate
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+
+# Serialized once; the rendered template interpolates the same schema.
+_SCHEMA_JSON = _json_dumps(PURE_MATH_JSON_SCHEMA)
+
+# Keep shared-memory windows alive for the life of the process; freeing one
+# would invalidate the buffers handed out below.
+_SHM_WINS: List[MPI.Win] = []
+
+
+def _node_shared_text(render) -> str:
+    """
+    Render a constant string once per node and distribute it through an MPI
+    shared-memory window on node_comm: the node leader calls render() and
+    writes the encoded bytes, the other ranks on the node map the same
+    physical pages via Shared_query instead of re-rendering.
+    """
+    if node_comm.Get_size() == 1:
+        return render()
+    data = render().encode() if local_rank == 0 else b""
+    nbytes = node_comm.bcast(len(data), root=0)
+    win = MPI.Win.Allocate_shared(nbytes if local_rank == 0 else 0, 1, comm=node_comm)
+    _SHM_WINS.append(win)
+    buf, _ = win.Shared_query(0)
+    if local_rank == 0:
+        buf[:nbytes] = data
+    node_comm.Barrier()
+    return bytes(buf[:nbytes]).decode()
+
+
+# The rendered template (schema included) is identical for all 12 ranks of a
+# node, so only the leader pays the format() + dumps cost; splitting on a
+# sentinel reduces build_prompt to string concatenation.
+_PROMPT_HEAD, _PROMPT_TAIL = _node_shared_text(
+    lambda: PROMPT_TEMPLATE.format(schema=_SCHEMA_JSON, latex_raw="\0")
+).split("\0")
+
+# Fixed number of prompt characters contributed by the template + schema;
+# only the LaTeX payload varies per row.
+_TEMPLATE_OVERHEAD = len(_PROMPT_HEAD) + len(_PROMPT_TAIL)
+
+# Output schema is fixed; declaring it keeps every row group identical even
+# when a batch happens to contain no successfully parsed rows.
+ARROW_SCHEMA = pa.schema(
+    [
+        ("paper_id", pa.string()),
+        ("equation_id", pa.string()),
+        ("latex_raw", pa.string()),
+        ("latex_clean", pa.string()),
+        ("llm_raw_output", pa.string()),
+        ("global_row", pa.int64()),
+        ("math_keywords", pa.string()),
+        ("math_sentence", pa.string()),
+        ("katex", pa.string()),
+        ("equiv_form_1", pa.string()),
+        ("equiv_form_2", pa.string()),
+        ("output_json", pa.string()),
+    ]
+)
+
+
 def katex_hygiene(s: str) -> str:
     """Lightweight KaTeX hygiene."""
-    s = re.sub(r"\\label\{[^}]*\}", "", s)
+    s = _LABEL_RE.sub("", s)
     return s.strip().rstrip(",")
 
 
 def build_prompt(latex_raw: str) -> str:
     """Fill your pure-math JSON prompt template."""
-    return PROMPT_TEMPLATE.format(
-        schema=json.dumps(PURE_MATH_JSON_SCHEMA, ensure_ascii=False),
-        latex_raw=latex_raw,
-    )
+    return _PROMPT_HEAD + latex_raw + _PROMPT_TAIL
 
 
 def parse_strict_json(s: str) -> Dict[str, Any]:
@@ -90,11 +207,11 @@ def parse_strict_json(s: str) -> Dict[str, Any]:
     Extract the final JSON object from the model's message *content* and
     validate it against PURE_MATH_JSON_SCHEMA.
     """
-    m = re.search(r"\{.*\}\s*$", s, flags=re.DOTALL)
+    m = _JSON_TAIL_RE.search(s)
     if not m:
         raise ValueError("No JSON found in model output")
-    obj = json.loads(m.group(0))
-    Draft7Validator(PURE_MATH_JSON_SCHEMA).validate(obj)
+    obj = _json_loads(m.group(0))
+    _validate(obj)
     return obj
 
 
@@ -106,34 +223,114 @@ def load_parquets(src_dir: Path) -> List[Path]:
 # =============================================================================
 # llama-server invocation
 # =============================================================================
+
+# Request payloads differ only in prompt and max_tokens, so each worker thread
+# mutates its own prototype instead of rebuilding the nested dict per call.
+_THREAD_STATE = threading.local()
+
+
+def _payload_for(prompt: str, max_tokens: int) -> Dict[str, Any]:
+    payload = getattr(_THREAD_STATE, "payload", None)
+    if payload is None:
+        if SERVER_ENDPOINT == "chat":
+            payload = {
+                "model": "gpt-oss-120b",
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": "",
+                    }
+                ],
+                "max_tokens": MAX_GENERATION_TOKENS,
+                "temperature": 0.0,
+                "top_p": 1.0,
+                "n": 1,
+                # llama-server honors slot prefix caching on the chat endpoint
+                # too; confirm hits via timings.prompt_n in the response.
+                "cache_prompt": True,
+                "stream": True,
+            }
+        else:
+            payload = {
+                "prompt": "",
+                "n_predict": MAX_GENERATION_TOKENS,
+                "temperature": 0.0,
+                "top_p": 1.0,
+                # Keep the shared template prefix in the slot KV cache
+                "cache_prompt": True,
+                "stream": True,
+            }
+        _THREAD_STATE.payload = payload
+    if SERVER_ENDPOINT == "chat":
+        payload["messages"][0]["content"] = prompt
+        payload["max_tokens"] = max_tokens
+    else:
+        payload["prompt"] = prompt
+        payload["n_predict"] = max_tokens
+    return payload
+
+
+def _consume_stream(resp: requests.Response) -> str:
+    """
+    Accumulate streamed completion chunks. Whenever a chunk closes a brace,
+    try the cheap tail-parse + schema validation; on success, return early so
+    closing the response aborts any remaining generation on the server.
+    """
+    parts: List[str] = []
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data: "):
+            continue
+        data = line[len("data: "):]
+        if data == "[DONE]":
+            break
+        try:
+            chunk = _json_loads(data)
+        except Exception:
+            continue
+        if SERVER_ENDPOINT == "chat":
+            # Trailing usage/summary chunks carry "choices": []
+            choices = chunk.get("choices") or [{}]
+            piece = choices[0].get("delta", {}).get("content") or ""
+        else:
+            piece = chunk.get("content") or ""
+        if piece:
+            parts.append(piece)
+            if piece.rstrip().endswith("}"):
+                text = "".join(parts)
+                m = _JSON_TAIL_RE.search(text)
+                if m:
+                    try:
+                        _validate(_json_loads(m.group(0)))
+                    except Exception:
+                        continue
+                    return text
+        if chunk.get("stop") is True:
+            break
+    return "".join(parts)
+
+
+@lru_cache(maxsize=100_000)
 def llama_server_infer(prompt: str, max_tokens: int = MAX_GENERATION_TOKENS) -> str:
     """
     Call the node-local llama-server for this rank, with retries for transient
     'Loading model' (HTTP 503) responses.
+
+    Responses are memoized on (prompt, max_tokens): with temperature=0.0 and
+    top_p=1.0 the server is deterministic, so duplicate equations (common in
+    math corpora) skip the LLM call entirely.
     """
     port = SERVER_BASE_PORT + local_rank
-    url = f"http://127.0.0.1:{port}/v1/chat/completions"
-
-    payload = {
-        "model": "gpt-oss-120b",
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-        "max_tokens": max_tokens,
-        "temperature": 0.0,
-        "top_p": 1.0,
-        "n": 1,
-    }
+    path = "/v1/chat/completions" if SERVER_ENDPOINT == "chat" else "/completion"
+    url = f"http://127.0.0.1:{port}{path}"
+
+    payload = _payload_for(prompt, max_tokens)
 
     max_attempts = 60          # e.g. up to 10 minutes if sleep=10s
     sleep_seconds = 10.0
 
     for attempt in range(1, max_attempts + 1):
         try:
-            resp = requests.post(url, json=payload, timeout=SERVER_TIMEOUT)
+            resp = SESSION.post(url, json=payload, timeout=SERVER_TIMEOUT, stream=True)
         except Exception as e:
             # Network / connection error: backoff and retry
             if attempt == max_attempts:
@@ -180,22 +377,16 @@ def llama_server_infer(prompt: str, max_tokens: int = MAX_GENERATION_TOKENS) ->
                 f"[RANK {world_rank}] llama-server returned HTTP {resp.status_code}: {err}"
             )
 
-        # Parse normal successful response
-        try:
-            data = resp.json()
-        except Exception as e:
-            raise RuntimeError(
-                f"[RANK {world_rank}] Failed to parse JSON response from llama-server: {resp.text}"
-            ) from e
-
+        # Consume the SSE stream; returning early (valid JSON seen) closes the
+        # connection and cancels whatever generation would have followed.
         try:
-            content = data["choices"][0]["message"]["content"]
+            return _consume_stream(resp)
         except Exception as e:
             raise RuntimeError(
-                f"[RANK {world_rank}] Unexpected /v1/chat/completions schema: {data}"
+                f"[RANK {world_rank}] Failed reading streamed response from {url}: {e}"
             ) from e
-
-        return content
+        finally:
+            resp.close()
 
     # Defensive; should be unreachable
     raise RuntimeError(
@@ -207,91 +398,165 @@ def llama_server_infer(prompt: str, max_tokens: int = MAX_GENERATION_TOKENS) ->
 # Row-sharded processing
 # =============================================================================
 
-def process_file_row_sharded(
-    pq_path: Path,
-    dst_dir: Path,
-    model_path: str,  # kept for CLI compatibility; unused with llama-server
-    ctx: int,
-    ngl: int,
-) -> None:
-    """
-    Process a single Parquet file with row-wise sharding:
+# Only these input columns are ever touched; everything else stays compressed.
+_INPUT_COLUMNS = ("paper_id", "equation_id", "content_resolved", "LLM_prompt")
 
-        my_rows = { i | 0 <= i < N, i % world_size == world_rank }
 
-    `ctx` is used only to approximate a character budget for skipping too-long
-    prompts; the *actual* context is set in llama-server.
+def _load_file_columns(
+    pq_path: Path, max_prompt_chars: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    df = pd.read_parquet(pq_path)
-
-    # optional filtering
-    if "LLM_prompt" in df.columns:
-        df = df[df["LLM_prompt"].isin({"LLM", "API"})]
-
-    total_rows = len(df)
-    print(f"[RANK {world_rank}] {pq_path.name}: {total_rows} rows", flush=True)
+    Stream the input Parquet one row group at a time, decompressing only the
+    columns the pipeline needs and applying the LLM_prompt / prompt-length
+    filters per batch. Peak memory is one row group plus the retained pruned
+    columns instead of the fully materialized file.
+
+    The fourth array holds each kept row's absolute position in the source
+    file, assigned *before* any filtering: resume compares these against the
+    flushed global_row values, so they must not shift when --ctx, the rendered
+    template size, or the filter outcome changes between runs.
+    """
+    pf = pq.ParquetFile(pq_path, pre_buffer=True)
+    available = set(pf.schema_arrow.names)
+    columns = [c for c in _INPUT_COLUMNS if c in available]
+
+    # Column presence is a per-file fact; resolve it once here rather than
+    # with per-row .get() lookups (missing columns yield None / "" as before).
+    has_paper = "paper_id" in available
+    has_eq = "equation_id" in available
+    has_content = "content_resolved" in available
+
+    papers: List[np.ndarray] = []
+    eqs: List[np.ndarray] = []
+    contents: List[np.ndarray] = []
+    row_idx: List[np.ndarray] = []
+    n_too_long = 0
+    file_row = 0
+
+    for rg_idx in range(pf.num_row_groups):
+        batch = pf.read_row_group(rg_idx, columns=columns, use_threads=True).to_pandas()
+
+        # Absolute file positions for this row group, fixed before filtering.
+        orig = np.arange(file_row, file_row + len(batch), dtype=np.int64)
+        file_row += len(batch)
+
+        # optional filtering
+        if "LLM_prompt" in batch.columns:
+            keep = batch["LLM_prompt"].isin({"LLM", "API"})
+            batch = batch[keep]
+            orig = orig[keep.to_numpy()]
+
+        if has_content:
+            # The template overhead is constant, so over-long rows are dropped
+            # with one vectorized mask instead of building each prompt first.
+            fits = (
+                batch["content_resolved"].str.len().fillna(0) + _TEMPLATE_OVERHEAD
+                <= max_prompt_chars
+            )
+            n_too_long += int((~fits).sum())
+            batch = batch[fits]
+            orig = orig[fits.to_numpy()]
+            contents.append(
+                batch["content_resolved"].fillna("").astype(str).to_numpy()
+            )
+        else:
+            contents.append(np.full(len(batch), "", dtype=object))
 
-    # Per-rank output file
-    out_path = dst_dir / f"{pq_path.stem}__rank{world_rank:04d}.parquet"
-    ckpt_path = dst_dir / "checkpoints" / f"{pq_path.stem}__rank{world_rank:04d}.ckpt.json"
+        row_idx.append(orig)
 
-    # Only rank 0 creates directories
-    if world_rank == 0:
-        dst_dir.mkdir(parents=True, exist_ok=True)
-        (dst_dir / "checkpoints").mkdir(parents=True, exist_ok=True)
-    comm.Barrier()
-
-    # Read checkpoint (last processed "block index" for this rank)
-    if ckpt_path.exists():
-        try:
-            start_offset = int(json.loads(ckpt_path.read_text()).get("row_offset", 0))
-        except Exception:
-            start_offset = 0
-    else:
-        start_offset = 0
+        papers.append(
+            batch["paper_id"].to_numpy()
+            if has_paper
+            else np.full(len(batch), None, dtype=object)
+        )
+        eqs.append(
+            batch["equation_id"].to_numpy()
+            if has_eq
+            else np.full(len(batch), None, dtype=object)
+        )
 
-    print(f"[RANK {world_rank}] Resume offset = {start_offset}", flush=True)
+    if n_too_long:
+        print(
+            f"[RANK {world_rank}] {pq_path.name}: skipping {n_too_long} rows "
+            f"with prompts over {max_prompt_chars} chars",
+            flush=True,
+        )
 
-    # Row-sharding: each rank handles rows i where i % world_size == world_rank
-    my_rows = list(range(world_rank + start_offset * world_size, total_rows, world_size))
+    if not contents:
+        empty = np.empty(0, dtype=object)
+        return empty, empty, empty, np.empty(0, dtype=np.int64)
+    return (
+        np.concatenate(papers),
+        np.concatenate(eqs),
+        np.concatenate(contents),
+        np.concatenate(row_idx),
+    )
 
-    # Approximate char budget from ctx (very coarse; we prefer skipping to OOM)
-    max_prompt_chars = int(ctx * 4)  # ~4 chars/token
 
-    buffer: List[Dict[str, Any]] = []
-    # Smaller flush interval for easier debugging; bump once throughput is validated.
-    flush_every = 20
+# Work item for one unique cleaned expression plus every row that shares it;
+# each duplicate row carries (global_row, paper_id, eq_id, latex_raw).
+KeyTask = Tuple[str, List[Tuple[int, Any, Any, str]]]
 
-    count = 0
-    for global_row_index in my_rows:
-        row = df.iloc[global_row_index]
 
-        paper_id = row.get("paper_id")
-        eq_id = row.get("equation_id")
+def _stable_key_shard(key: str) -> int:
+    """Rank that owns this key. blake2b is unsalted, so ranks always agree."""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % world_size
 
-        latex_raw = str(row.get("content_resolved", "") or "")
-        latex_clean = katex_hygiene(latex_raw)
-        prompt = build_prompt(latex_clean)
 
-        # Aggressively skip over-long prompts to keep memory bounded & throughput high
-        if len(prompt) > max_prompt_chars:
-            print(
-                f"[RANK {world_rank}] SKIP row {global_row_index}: "
-                f"prompt too long (len={len(prompt)} > {max_prompt_chars})",
-                flush=True,
-            )
-            continue
+def _infer_key(task: KeyTask) -> Optional[List[Dict[str, Any]]]:
+    """
+    Run one unique cleaned expression through llama-server and expand the
+    result into one record per duplicate row. Returns None on hard inference
+    failure (the key is logged and dropped, matching the previous per-row
+    behavior).
+
+    The prompt is rendered here, in the worker, so the producer loop only
+    touches rows that passed the vectorized length filter and the template
+    formatting runs off the main thread.
+    """
+    latex_clean, rows = task
+    prompt = build_prompt(latex_clean)
 
+    try:
+        content = llama_server_infer(prompt, max_tokens=MAX_GENERATION_TOKENS)
         try:
-            content = llama_server_infer(prompt, max_tokens=MAX_GENERATION_TOKENS)
-            try:
-                parsed = parse_strict_json(content)
-            except Exception:
-                parsed = None
-        except Exception as e:
-            print(f"[RANK {world_rank}] ERROR @ row {global_row_index}: {e}", flush=True)
-            continue
+            parsed = parse_strict_json(content)
+        except Exception:
+            parsed = None
+    except Exception as e:
+        print(
+            f"[RANK {world_rank}] ERROR @ row {rows[0][0]} "
+            f"({len(rows)} duplicate rows): {e}",
+            flush=True,
+        )
+        return None
+
+    # Serialize the parsed fields once; duplicates share the strings.
+    if parsed:
+        analysis = parsed["analysis"]
+        equivs = parsed["equivalents"]
+        parsed_fields = {
+            "math_keywords": _json_dumps(analysis["math_keywords"]),
+            "math_sentence": analysis["math_sentence"],
+            "katex": analysis["katex"],
+            "equiv_form_1": _json_dumps(equivs["equiv_form_1"]),
+            "equiv_form_2": _json_dumps(equivs["equiv_form_2"]),
+            "output_json": _json_dumps(parsed),
+        }
+    else:
+        # Stay None when strict-JSON validation failed (keeps the schema fixed)
+        parsed_fields = {
+            "math_keywords": None,
+            "math_sentence": None,
+            "katex": None,
+            "equiv_form_1": None,
+            "equiv_form_2": None,
+            "output_json": None,
+        }
 
+    recs: List[Dict[str, Any]] = []
+    for global_row_index, paper_id, eq_id, latex_raw in rows:
         rec: Dict[str, Any] = {
             "paper_id": paper_id,
             "equation_id": eq_id,
@@ -300,63 +565,183 @@ def process_file_row_sharded(
             "llm_raw_output": content,
             "global_row": global_row_index,
         }
+        rec.update(parsed_fields)
+        recs.append(rec)
+    return recs
 
-        if parsed:
-            analysis = parsed["analysis"]
-            equivs = parsed["equivalents"]
-            rec.update(
-                {
-                    "math_keywords": json.dumps(
-                        analysis["math_keywords"], ensure_ascii=False
-                    ),
-                    "math_sentence": analysis["math_sentence"],
-                    "katex": analysis["katex"],
-                    "equiv_form_1": json.dumps(
-                        equivs["equiv_form_1"], ensure_ascii=False
-                    ),
-                    "equiv_form_2": json.dumps(
-                        equivs["equiv_form_2"], ensure_ascii=False
-                    ),
-                    "output_json": json.dumps(parsed, ensure_ascii=False),
-                }
-            )
 
-        buffer.append(rec)
-        count += 1
+def process_file_row_sharded(
+    pq_path: Path,
+    dst_dir: Path,
+    model_path: str,  # kept for CLI compatibility; unused with llama-server
+    ctx: int,
+    ngl: int,
+    concurrency: int = 1,
+    columns: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+) -> None:
+    """
+    Process a single Parquet file with duplicate-folded key sharding:
+
+        my_keys = { katex_hygiene(content) | blake2b(key) % world_size == world_rank }
+
+    Exact duplicate expressions (common in math corpora) are inferenced once
+    per file and the result expanded to every duplicate row, and hashing the
+    keys keeps the shards balanced across ranks.
+
+    `ctx` is used only to approximate a character budget for skipping too-long
+    prompts; the *actual* context is set in llama-server.
+    """
+    # Approximate char budget from ctx (very coarse; we prefer skipping to OOM)
+    max_prompt_chars = int(ctx * 4)  # ~4 chars/token
+
+    # Flat numpy arrays of the needed columns, streamed row group by row group;
+    # indexing these by position avoids boxing a pandas Series per row.
+    # `columns` is pre-populated when main() prefetched this file already.
+    if columns is None:
+        columns = _load_file_columns(pq_path, max_prompt_chars)
+    paper_ids, eq_ids, contents, row_indices = columns
 
-        if count % flush_every == 0:
-            _flush(out_path, buffer)
-            buffer.clear()
-            # Keep checkpoint in units of "chunks flushed"
-            _write_rank_ckpt(ckpt_path, count // flush_every)
-            print(f"[RANK {world_rank}] Flushed {count} rows", flush=True)
+    total_rows = len(contents)
+
+    # Per-rank output file (directories were created once in main())
+    out_path = dst_dir / f"{pq_path.stem}__rank{world_rank:04d}.parquet"
+
+    # Resume from the output itself: the flushed global_row values are the
+    # ground truth of what is done, so no side-channel offset can drift.
+    done_rows = _load_done_rows(out_path)
+    if done_rows:
+        print(
+            f"[RANK {world_rank}] Resuming {pq_path.name}: "
+            f"{len(done_rows)} rows already written",
+            flush=True,
+        )
+
+    # Fold exact duplicates before any LLM call: one entry per unique cleaned
+    # expression, in first-occurrence order, with every row that shares it.
+    unique_map: Dict[str, List[Tuple[int, Any, Any, str]]] = {}
+    for i in range(total_rows):
+        latex_raw = contents[i]
+        unique_map.setdefault(katex_hygiene(latex_raw), []).append(
+            (int(row_indices[i]), paper_ids[i], eq_ids[i], latex_raw)
+        )
+
+    # Shard unique keys, not rows; dedup then spans the whole file while the
+    # hash keeps per-rank load balanced. A key expands atomically, so its
+    # first row being on disk means the whole key is done.
+    my_keys = [k for k in unique_map if _stable_key_shard(k) == world_rank]
+    total_keys = len(my_keys)
+    my_keys = [k for k in my_keys if unique_map[k][0][0] not in done_rows]
+
+    print(
+        f"[RANK {world_rank}] {pq_path.name}: {len(unique_map)} unique of "
+        f"{total_rows} rows; this rank owns {total_keys} keys",
+        flush=True,
+    )
+
+    # Accumulate one Python list per output column; pa.Table.from_pydict can
+    # build columnar arrays from these directly, with no per-batch re-boxing
+    # of row dicts.
+    cols: Dict[str, List[Any]] = {name: [] for name in ARROW_SCHEMA.names}
+    # Flushes are append-only row groups now, so a larger interval costs
+    # nothing on rewrite and amortizes the checkpoint fsync traffic.
+    flush_every = 200
+
+    # Parquet cannot be appended in place, so resumed runs write an additional
+    # part file next to the existing output instead of rewriting it.
+    write_path = _next_part_path(out_path)
+    writer: Optional[pq.ParquetWriter] = None
+
+    def _flush() -> None:
+        """Append the buffered records as one row group; O(batch), not O(file)."""
+        nonlocal writer
+        if not cols["global_row"]:
+            return
+        table = pa.Table.from_pydict(cols, schema=ARROW_SCHEMA)
+        if writer is None:
+            writer = pq.ParquetWriter(write_path, ARROW_SCHEMA, compression="zstd")
+        writer.write_table(table)
+        for values in cols.values():
+            values.clear()
+
+    count = 0
+    pending: List[KeyTask] = []
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _drain_pending() -> None:
+        """Submit the buffered tasks as one wave; flush results in key order."""
+        nonlocal count
+        for recs in executor.map(_infer_key, pending):
+            if recs is None:
+                continue
+            for rec in recs:
+                for name in ARROW_SCHEMA.names:
+                    cols[name].append(rec[name])
+            count += len(recs)
+            if len(cols["global_row"]) >= flush_every:
+                _flush()
+                print(f"[RANK {world_rank}] Flushed {count} rows", flush=True)
+        pending.clear()
+
+    for key in my_keys:
+        # Buffer up to `concurrency` prompts so the server can batch them
+        # into shared decode steps (one prompt per server slot).
+        pending.append((key, unique_map[key]))
+        if len(pending) >= concurrency:
+            _drain_pending()
+
+    _drain_pending()
+    executor.shutdown()
 
     # Final flush
-    _flush(out_path, buffer)
-    _write_rank_ckpt(ckpt_path, len(my_rows))
+    _flush()
+    if writer is not None:
+        writer.close()
     print(
-        f"[RANK {world_rank}] DONE {pq_path.name}: processed {len(my_rows)} rows",
+        f"[RANK {world_rank}] DONE {pq_path.name}: processed {count} rows "
+        f"across {total_keys} keys",
         flush=True,
     )
 
 
 # ---- small helpers used above ----
 
-def _flush(out_path: Path, records: List[Dict[str, Any]]) -> None:
-    if not records:
-        return
-    df_new = pd.DataFrame(records)
-    if out_path.exists():
-        df_old = pd.read_parquet(out_path)
-        pd.concat([df_old, df_new], ignore_index=True).to_parquet(
-            out_path, index=False
-        )
-    else:
-        df_new.to_parquet(out_path, index=False)
+def _next_part_path(out_path: Path) -> Path:
+    """
+    First free output path for this (file, rank). Downstream readers treat the
+    destination as a directory-of-files dataset, so parts concatenate logically.
+    """
+    if not out_path.exists():
+        return out_path
+    part = 1
+    while True:
+        cand = out_path.with_name(f"{out_path.stem}.part{part}.parquet")
+        if not cand.exists():
+            return cand
+        part += 1
 
 
-def _write_rank_ckpt(ckpt: Path, offset: int) -> None:
-    ckpt.write_text(json.dumps({"row_offset": offset}, ensure_ascii=False))
+def _load_done_rows(out_path: Path) -> set:
+    """
+    Global rows this rank has already written for a file, gathered from the
+    main output and any resume part files. Only the global_row column is
+    decompressed.
+    """
+    done: set = set()
+    for path in out_path.parent.glob(f"{out_path.stem}*.parquet"):
+        try:
+            col = pq.read_table(path, columns=["global_row"])
+        except Exception:
+            # Torn file from a crash mid-write: its rows are redone, and the
+            # file is moved aside so dataset reads over the directory don't
+            # fail on the footer-less member.
+            try:
+                os.replace(path, path.with_suffix(path.suffix + ".corrupt"))
+                print(f"[RANK {world_rank}] Moved torn output aside: {path}", flush=True)
+            except OSError:
+                pass
+            continue
+        done.update(col.column("global_row").to_pylist())
+    return done
 
 
 # =============================================================================
@@ -372,11 +757,19 @@ def main() -> None:
     ap.add_argument("--model", required=True)  # kept for interface symmetry (unused)
     ap.add_argument("--ctx", type=int, default=1024)  # used only for char budget
     ap.add_argument("--ngl", type=int, default=80)    # unused with llama-server
+    # Number of in-flight requests per rank; match llama-server's --parallel
+    ap.add_argument("--concurrency", type=int, default=1)
     args = ap.parse_args()
 
     src_dir = Path(args.src)
     dst_dir = Path(args.dst)
 
+    # Create the output directory once up front; a single Barrier here replaces
+    # the per-file Barrier, so ranks then progress fully independently.
+    if world_rank == 0:
+        dst_dir.mkdir(parents=True, exist_ok=True)
+    comm.Barrier()
+
     files = load_parquets(src_dir)
     print(
         f"[RANK {world_rank}] Found {len(files)} parquet files; "
@@ -384,9 +777,34 @@ def main() -> None:
         flush=True,
     )
 
+    # Overlap input I/O with inference: a background thread decodes the next
+    # file's columns while this rank's LLM requests are in flight. maxsize=1
+    # keeps at most one prefetched file resident.
+    max_prompt_chars = int(args.ctx * 4)
+    prefetched: "queue.Queue" = queue.Queue(maxsize=1)
+
+    def _prefetch_worker() -> None:
+        # Ship any load failure through the queue: a bare raise would only
+        # kill this daemon thread and leave the consumer blocked forever.
+        for pq_path in files:
+            try:
+                prefetched.put(_load_file_columns(pq_path, max_prompt_chars))
+            except BaseException as e:
+                prefetched.put(e)
+                return
+
+    threading.Thread(target=_prefetch_worker, daemon=True).start()
+
     # Each rank processes *all files* (row-sharded)
-    for pq in files:
-        process_file_row_sharded(pq, dst_dir, args.model, args.ctx, args.ngl)
+    for pq_path in files:
+        columns = prefetched.get()
+        if isinstance(columns, BaseException):
+            print(f"[RANK {world_rank}] ERROR prefetching {pq_path}: {columns}", flush=True)
+            raise columns
+        process_file_row_sharded(
+            pq_path, dst_dir, args.model, args.ctx, args.ngl,
+            args.concurrency, columns,
+        )
 
 
 if __name__ == "__main__":
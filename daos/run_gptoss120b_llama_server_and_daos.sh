@@ -28,7 +28,8 @@ MODEL_BASENAME_FIRST="${MODEL_PREFIX}-00001-of-00002.gguf"
 # ----------------------------------------------------------------------------
 BASE_PORT=18080        # first port per node; rank k uses BASE_PORT + local_rank
 SERVERS_PER_NODE=6     # one per XPU
-CTX_SIZE=1024          # context size for llama-server
+CTX_SIZE=1024          # context size for llama-server (per slot)
+SERVERS_CONCURRENCY=4  # slots per server (--parallel) == client --concurrency
 GPU_LAYERS=90          # n-gpu-layers
 N_THREADS=32           # CPU threads per server (tune later); 208 available per comp. node
 LLAMA_CPP_DIR="/lus/flare/projects/FoundEpidem/siebenschuh/gpt-oss-120b-intel-max-gpu/scripts/llama.cpp"
@@ -127,6 +128,7 @@ clush -w "${NODES}" "bash -lc '
   BASE_PORT=${BASE_PORT}
   SERVERS_PER_NODE=${SERVERS_PER_NODE}
   CTX_SIZE=${CTX_SIZE}
+  SERVERS_CONCURRENCY=${SERVERS_CONCURRENCY}
   GPU_LAYERS=${GPU_LAYERS}
   N_THREADS=${N_THREADS}
 
@@ -141,7 +143,8 @@ clush -w "${NODES}" "bash -lc '
 
     \"\${LLAMA_CPP_DIR}/build/bin/llama-server\" \
       --model \"\${MODEL_PATH}\" \
-      --ctx-size \"\${CTX_SIZE}\" \
+      --ctx-size \$((CTX_SIZE * SERVERS_CONCURRENCY)) \
+      --parallel \"\${SERVERS_CONCURRENCY}\" \
       --n-gpu-layers \"\${GPU_LAYERS}\" \
       --threads \"\${N_THREADS}\" \
       --port \"\${PORT}\" \
@@ -222,6 +225,7 @@ echo "LOCAL_MODEL_DIR = ${LOCAL_MODEL_DIR}"
 echo "LUSTRE_OUT      = ${LUSTRE_OUT}"
 echo "BASE_PORT       = ${BASE_PORT}"
 echo "SERVERS_PER_NODE= ${SERVERS_PER_NODE}"
+echo "SERVERS_CONCURRENCY = ${SERVERS_CONCURRENCY}"
 
 # -----------------------------------------------------------------------------
 # Periodic rsync from DAOS -> Lustre (runs on the job launch node)
@@ -266,7 +270,8 @@ mpiexec -np "${NRANKS}" -ppn "${RANKS_PER_NODE}" \
     --dst "${DST_DIR}" \
     --model "${MODEL_PATH}" \
     --ctx "${CTX_SIZE}" \
-    --ngl "${GPU_LAYERS}"
+    --ngl "${GPU_LAYERS}" \
+    --concurrency "${SERVERS_CONCURRENCY}"
 
 MPI_STATUS=$?
 
@@ -0,0 +1,18 @@
+"""Small MPI helpers shared by the multi-xpu scripts."""
+
+from mpi4py import MPI
+
+# Sub-communicators keyed by the parent comm's handle address. Split_type is
+# a collective that needs global negotiation, so reuse the result whenever a
+# script (or a loop importing both scripts) asks for the same parent again.
+_NODE_COMMS: dict = {}
+
+
+def node_comm_of(parent: MPI.Comm = MPI.COMM_WORLD) -> MPI.Comm:
+    """Return the node-local (COMM_TYPE_SHARED) communicator for `parent`."""
+    key = MPI._addressof(parent)
+    node_comm = _NODE_COMMS.get(key)
+    if node_comm is None:
+        node_comm = parent.Split_type(MPI.COMM_TYPE_SHARED, 0, info=MPI.INFO_NULL)
+        _NODE_COMMS[key] = node_comm
+    return node_comm
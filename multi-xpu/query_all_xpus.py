@@ -11,8 +11,16 @@ Use:
 
 from mpi4py import MPI
 import os
-import socket
+import pickle
 import subprocess
+import sys
+
+from mpi_utils import node_comm_of
+
+try:  # in-process Level Zero queries; the sycl-ls subprocess is the fallback
+    import dpctl
+except ImportError:
+    dpctl = None
 
 
 # -----------------------------------------------------------------------------
@@ -23,44 +31,135 @@ world_rank = comm.Get_rank()
 world_size = comm.Get_size()
 
 # Get node-local communicator so each node computes its own local rank
-node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, 0)
+# (cached per parent comm so repeated calls skip the collective split)
+node_comm = node_comm_of(comm)
 local_rank = node_comm.Get_rank()
 
-hostname = socket.gethostname()
+# MPI already knows the processor name; no DNS/NIS lookup via socket needed
+hostname = MPI.Get_processor_name()
 
 # Bind this rank to exactly one XPU device on the node
 os.environ["ONEAPI_DEVICE_SELECTOR"] = f"level_zero:{local_rank}"
 
 # -----------------------------------------------------------------------------
-# Query device using sycl-ls restricted by ONEAPI_DEVICE_SELECTOR
+# Query device; in-process via dpctl, else one sycl-ls per node whose output
+# is broadcast to the node's other ranks
 # -----------------------------------------------------------------------------
-def query_xpu() -> str:
-    """Return a one-line sycl-ls description of the XPU assigned."""
+# hostname -> per-device lines, for every node in the job; filled once
+_HOST_DEVICE_MAP = {}
+
+
+def _job_cache_path() -> str:
+    job_id = os.environ.get("PBS_JOBID") or os.environ.get("SLURM_JOB_ID") or "interactive"
+    return f"/tmp/xpu_map.{job_id}.pkl"
+
+
+def _leader_sycl_ls() -> list:
+    """Run sycl-ls once with the selector unset; node leader only."""
+    env = {**os.environ}
+    env.pop("ONEAPI_DEVICE_SELECTOR", None)
+    # Fully buffered Popen + one communicate() drain (a single read per
+    # pipe) with a timeout so a hung runtime can't stall the whole node.
+    p = subprocess.Popen(
+        ["sycl-ls"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=-1,
+        env=env,
+    )
     try:
-        out = subprocess.check_output(
-            ["sycl-ls"],
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        # sycl-ls prints multiple lines, but with ONEAPI_DEVICE_SELECTOR set,
-        # it prints only the bound device.
-        return out.strip()
-    except subprocess.CalledProcessError as e:
-        return f"sycl-ls error: {e.output}"
+        out, _ = p.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.communicate()
+        out = None
+    if out is None:
+        return ["sycl-ls error: timed out after 10s"]
+    if p.returncode != 0:
+        return [f"sycl-ls error: {out}"]
+    lines = [ln for ln in out.splitlines() if ln.strip()]
+    # Index by Level Zero device ordinal when possible
+    return [ln for ln in lines if "level_zero" in ln] or lines
+
+
+def node_device_map() -> dict:
+    """
+    Device lines bucketed by hostname for the whole job. Node leaders
+    allgather their (hostname, devices) pairs once and fan the map out over
+    node_comm; the result is memoized in-process and pickled under /tmp keyed
+    by the job id, so reruns inside the same allocation skip the subprocess
+    entirely.
+    """
+    if _HOST_DEVICE_MAP:
+        return _HOST_DEVICE_MAP
+
+    host_map = None
+    if local_rank == 0:
+        try:
+            with open(_job_cache_path(), "rb") as fh:
+                cached = pickle.load(fh)
+        except (OSError, pickle.PickleError):
+            cached = None
+
+        devices = cached.get(hostname) if cached else None
+        if devices is None:
+            devices = _leader_sycl_ls()
+
+        leaders_comm = comm.Split(0, world_rank)
+        host_map = dict(leaders_comm.allgather((hostname, devices)))
+        leaders_comm.Free()
+
+        if world_rank == 0 and host_map != cached:
+            try:
+                with open(_job_cache_path(), "wb") as fh:
+                    pickle.dump(host_map, fh)
+            except OSError:
+                pass
+    else:
+        # Split is collective over COMM_WORLD; non-leaders opt out
+        comm.Split(MPI.UNDEFINED, world_rank)
+
+    host_map = node_comm.bcast(host_map, root=0)
+    _HOST_DEVICE_MAP.update(host_map)
+    return _HOST_DEVICE_MAP
+
+
+def query_xpu() -> str:
+    """Return a one-line description of the XPU assigned to this rank."""
+    if dpctl is not None:
+        # Direct Level Zero binding: no fork/exec per rank, no stdout parsing.
+        # ONEAPI_DEVICE_SELECTOR is already set above, which filters AND
+        # renumbers the visible devices from 0 — so the bound XPU is always
+        # ordinal 0 here, regardless of local_rank.
+        try:
+            dev = dpctl.SyclDevice("level_zero:0")
+            return (
+                f"{dev.name} [driver {dev.driver_version}, "
+                f"{dev.global_mem_size / 2**30:.1f} GiB global mem]"
+            )
+        except Exception as e:
+            return f"dpctl error: {e}"
+
+    devices = node_device_map().get(hostname, [])
+    if local_rank < len(devices):
+        return devices[local_rank].strip()
+    return f"no sycl-ls entry for device ordinal {local_rank}"
 
 
 device_info = query_xpu()
 
 # -----------------------------------------------------------------------------
-# Print summary for this rank
+# Gather all summaries so rank 0 is the only stdout writer: one ordered write
+# instead of world_size interleaved flushes through the mpirun launcher
 # -----------------------------------------------------------------------------
-print(
+msg = (
     f"[WORLD {world_rank:02d}/{world_size:02d}] "
     f"NODE={hostname} LOCAL_RANK={local_rank:02d} "
     f"XPU=level_zero:{local_rank}\n"
-    f"{device_info}\n",
-    flush=True
+    f"{device_info}\n"
 )
-
-comm.Barrier()
+all_msgs = comm.gather(msg, root=0)
+if world_rank == 0:
+    sys.stdout.write("\n".join(all_msgs) + "\n")
 
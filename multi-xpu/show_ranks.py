@@ -1,28 +1,31 @@
 #!/usr/bin/env python
 from mpi4py import MPI
 import os
-import socket
+import sys
+
+from mpi_utils import node_comm_of
 
 # ----- MPI setup -----
 comm = MPI.COMM_WORLD
 world_rank = comm.Get_rank()
 world_size = comm.Get_size()
 
-# Node-local communicator to compute local rank per node
-node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, 0)
+# Node-local communicator to compute local rank per node (cached helper)
+node_comm = node_comm_of(comm)
 local_rank = node_comm.Get_rank()
 
-hostname = socket.gethostname()
+hostname = MPI.Get_processor_name()
 
 # Bind this rank to one Intel XPU (Level Zero device = local_rank)
 os.environ["ONEAPI_DEVICE_SELECTOR"] = f"level_zero:{local_rank}"
 
-print(
+# Gather all lines so rank 0 is the only stdout writer; output is ordered by
+# rank and the end-of-script barrier becomes unnecessary
+msg = (
     f"[WORLD {world_rank}/{world_size} | NODE {hostname} | LOCAL {local_rank}] "
-    f"ONEAPI_DEVICE_SELECTOR={os.environ['ONEAPI_DEVICE_SELECTOR']}",
-    flush=True,
+    f"ONEAPI_DEVICE_SELECTOR={os.environ['ONEAPI_DEVICE_SELECTOR']}"
 )
-
-# Optional barrier so output from all ranks is flushed before exit
-comm.Barrier()
+all_msgs = comm.gather(msg, root=0)
+if world_rank == 0:
+    sys.stdout.write("\n".join(all_msgs) + "\n")
 
@@ -11,7 +11,6 @@ Use:
 
 from mpi4py import MPI
 import os
-import socket
 import subprocess
 
 
@@ -26,7 +25,7 @@ world_size = comm.Get_size()
 node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, 0)
 local_rank = node_comm.Get_rank()
 
-hostname = socket.gethostname()
+hostname = MPI.Get_processor_name()
 
 # Bind this rank to exactly one XPU device on the node
 os.environ["ONEAPI_DEVICE_SELECTOR"] = f"level_zero:{local_rank}"
@@ -62,5 +61,3 @@ print(
     flush=True
 )
 
-comm.Barrier()
-
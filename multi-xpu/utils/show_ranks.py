@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 from mpi4py import MPI
 import os
-import socket
 
 # ----- MPI setup -----
 comm = MPI.COMM_WORLD
@@ -12,7 +11,7 @@ world_size = comm.Get_size()
 node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, 0)
 local_rank = node_comm.Get_rank()
 
-hostname = socket.gethostname()
+hostname = MPI.Get_processor_name()
 
 # Bind this rank to one Intel XPU (Level Zero device = local_rank)
 os.environ["ONEAPI_DEVICE_SELECTOR"] = f"level_zero:{local_rank}"
@@ -23,6 +22,3 @@ print(
     flush=True,
 )
 
-# Optional barrier so output from all ranks is flushed before exit
-comm.Barrier()
-
@@ -1,25 +1,64 @@
+import os
 import re
 import json
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from typing import Any, List, Dict
 from jsonschema import Draft7Validator
 
+try:  # compiles the schema to a specialized function (~10x faster validate)
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:  # Rust JSON codec; several times faster than the stdlib on our payloads
+    import orjson
+except ImportError:
+    orjson = None
+
 from math_prompt import PROMPT_TEMPLATE, PURE_MATH_JSON_SCHEMA
 
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+# Compiled once at import; runs on every row, so skip the re-cache lookup
+_LABEL_RE = re.compile(r"\\label\{[^}]*\}")
+
+# The schema never changes, so render it into the template exactly once and
+# keep the text around the {latex_raw} slot; build_messages then only
+# concatenates three strings per row
+_SCHEMA_JSON = _json_dumps(PURE_MATH_JSON_SCHEMA)
+_PROMPT_HEAD, _PROMPT_TAIL = PROMPT_TEMPLATE.format(
+    schema=_SCHEMA_JSON, latex_raw="\0"
+).split("\0")
+
+# The schema is fixed, so compile it once here instead of walking it on every
+# validate call; jsonschema's interpreter stays as the fallback
+if fastjsonschema is not None:
+    _validate = fastjsonschema.compile(PURE_MATH_JSON_SCHEMA)
+else:
+    Draft7Validator.check_schema(PURE_MATH_JSON_SCHEMA)
+    _validate = Draft7Validator(PURE_MATH_JSON_SCHEMA).validate
+
 def katex_hygiene(s: str) -> str:
     """Minimal cleanup for better model output (we still prompt with cleaned string)."""
-    s = re.sub(r"\\label\{[^}]*\}", "", s)  # remove \label{...}
+    s = _LABEL_RE.sub("", s)  # remove \label{...}
     s = s.strip().rstrip(",")
     return s
 
 
 def build_messages(latex_raw: str) -> List[Dict[str, str]]:
     """Construct the chat messages for OpenAI-compatible endpoint."""
-    prompt = PROMPT_TEMPLATE.format(
-        schema=json.dumps(PURE_MATH_JSON_SCHEMA, ensure_ascii=False),
-        latex_raw=latex_raw,
-    )
+    prompt = _PROMPT_HEAD + latex_raw + _PROMPT_TAIL
     return [
         {"role": "system", "content": "You are precise and always return strict JSON only."},
         {"role": "user", "content": prompt},
@@ -31,37 +70,90 @@ def build_messages(latex_raw: str) -> List[Dict[str, str]]:
 
 def parse_strict_json(s: str) -> Dict[str, Any]:
     """Extract and validate the final JSON object from model content."""
-    m = re.search(r"\{.*\}\s*$", s, flags=re.DOTALL)
-    if not m:
+    # find/rfind beats the backtracking `\{.*\}` regex on long responses and
+    # brackets the same outermost object; the JSON parser rejects any garbage
+    # between the braces
+    start = s.find("{")
+    end = s.rfind("}")
+    if start == -1 or end < start:
         raise ValueError("No JSON object found in response")
-    obj = json.loads(m.group(0))
-    Draft7Validator(PURE_MATH_JSON_SCHEMA).validate(obj)
+    obj = _json_loads(s[start : end + 1])
+    _validate(obj)
     return obj
 
 
 def load_parquets(src_dir: Path) -> List[Path]:
-    return sorted([p for p in src_dir.iterdir() if p.suffix == ".parquet"])
+    # scandir avoids the per-entry Path construction and suffix parsing that
+    # iterdir does for the (many) non-parquet entries in large source dirs
+    with os.scandir(src_dir) as it:
+        names = [e.name for e in it if e.name.endswith(".parquet")]
+    names.sort()
+    return [src_dir / n for n in names]
 
 
 def read_checkpoint(ckpt_path: Path) -> int:
     if not ckpt_path.exists():
         return 0
     try:
-        return int(json.loads(ckpt_path.read_text()).get("row_index", 0))
+        return int(_json_loads(ckpt_path.read_bytes()).get("row_index", 0))
     except Exception:
         return 0
 
 
 def write_checkpoint(ckpt_path: Path, idx: int) -> None:
+    # Write to a sibling tmp file and rename over the checkpoint; os.replace
+    # is atomic on POSIX, so a crash mid-write can never leave a torn file
     ckpt_path.parent.mkdir(parents=True, exist_ok=True)
-    ckpt_path.write_text(json.dumps({"row_index": idx}, ensure_ascii=False))
+    tmp = ckpt_path.with_suffix(ckpt_path.suffix + ".tmp")
+    tmp.write_bytes(_json_dumps({"row_index": idx}).encode())
+    os.replace(tmp, ckpt_path)
+
+# Output schema is fixed; declaring it keeps every row group identical even
+# when a batch is missing keys or a column happens to be all-None (which
+# from_pylist would otherwise infer as the null type and trip the writer)
+ARROW_SCHEMA = pa.schema(
+    [
+        ("paper_id", pa.string()),
+        ("equation_id", pa.string()),
+        ("latex_raw", pa.string()),
+        ("latex_clean", pa.string()),
+        ("llm_raw_output", pa.string()),
+        ("global_row", pa.int64()),
+        ("math_keywords", pa.string()),
+        ("math_sentence", pa.string()),
+        ("katex", pa.string()),
+        ("equiv_form_1", pa.string()),
+        ("equiv_form_2", pa.string()),
+        ("output_json", pa.string()),
+    ]
+)
+
+def _next_part_path(out_path: Path) -> Path:
+    """
+    First unused path for this logical output: out_path itself, then numbered
+    .partN siblings. Rows already on disk are never rewritten; readers consume
+    the directory as one dataset.
+    """
+    if not out_path.exists():
+        return out_path
+    n = 1
+    while True:
+        cand = out_path.with_name(f"{out_path.stem}.part{n}{out_path.suffix}")
+        if not cand.exists():
+            return cand
+        n += 1
+
 
 def flush_records(out_path: Path, records: List[Dict[str, Any]]) -> None:
+    # Each flush lands as its own complete .partN file: the footer is on disk
+    # before this returns, so once the caller advances its checkpoint the
+    # flushed rows survive even a SIGKILL (walltime), and no writer fd stays
+    # open across the thousands of input shards a run covers.
     if not records:
         return
-    out_df = pd.DataFrame(records)
-    if out_path.exists():
-        prev = pd.read_parquet(out_path)
-        pd.concat([prev, out_df], ignore_index=True).to_parquet(out_path, index=False)
-    else:
-        out_df.to_parquet(out_path, index=False)
+    # from_pylist silently drops keys outside the schema; make that loud
+    unexpected = {k for rec in records for k in rec} - set(ARROW_SCHEMA.names)
+    if unexpected:
+        raise ValueError(f"record keys not in ARROW_SCHEMA: {sorted(unexpected)}")
+    table = pa.Table.from_pylist(records, schema=ARROW_SCHEMA)
+    pq.write_table(table, _next_part_path(out_path), compression="zstd")